@@ -1,16 +1,52 @@
-from dataclasses import dataclass
-from typing import List, Mapping
+import argparse
+import os
+import pickle
+import shlex
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from functools import lru_cache
+from itertools import chain
+from typing import (
+    Any,
+    Dict,
+    List,
+    Mapping,
+    Optional,
+    Tuple,
+)
 
 import yaml
 from tabulate import tabulate
 
+try:
+    from yaml import CSafeLoader
+except ImportError:
+    from yaml import SafeLoader as CSafeLoader
+
 materials_path = "materials.yaml"
 recipes_path = "recipes.yaml"
 facility_buildings_path = "facility_buildings.yaml"
 multipliers_path = "multipliers.yaml"
 
+ASSEMBLER = sys.intern("Assembler")
+SMELTING_FACILITY = sys.intern("Smelting Facility")
+CHEMICAL_FACILITY = sys.intern("Chemical Facility")
+RESEARCH_FACILITY = sys.intern("Research Facility")
+REFINING_FACILITY = sys.intern("Refining Facility")
+FACILITIES = (
+    ASSEMBLER,
+    SMELTING_FACILITY,
+    CHEMICAL_FACILITY,
+    RESEARCH_FACILITY,
+    REFINING_FACILITY,
+)
+
+# Bump whenever the cached data changes shape so stale caches are rebuilt.
+cache_version = 6
+
 
-@dataclass
+@dataclass(slots=True)
 class FacilityBuildings:
     assembler: List[str]
     smelting_facility: List[str]
@@ -19,14 +55,11 @@ class FacilityBuildings:
     refining_facility: List[str]
 
 
-@dataclass
-class Multipliers:
-    assembler: Mapping[str, float]
-    smelting_facility: Mapping[str, float]
-    chemical_facility: Mapping[str, float]
+# (facility, building) -> speed multiplier
+Multipliers = Mapping[Tuple[str, str], float]
 
 
-@dataclass
+@dataclass(slots=True)
 class MaterialWithAmount:
     name: str = ""
     amount: float = 0
@@ -45,16 +78,16 @@ class MaterialWithAmount:
         return MaterialWithAmount(self.name, self.amount / divisor)
 
 
-@dataclass
+@dataclass(slots=True)
 class Recipe:
-    input: List[MaterialWithAmount]
-    output: List[MaterialWithAmount]
+    input: Tuple[MaterialWithAmount, ...]
+    output: Tuple[MaterialWithAmount, ...]
     made_in: str
     duration: int
     enabled: bool
 
 
-@dataclass
+@dataclass(slots=True)
 class UserInput:
     material: str
     production_rate: float
@@ -66,35 +99,35 @@ class UserInput:
     def multiplier_for_facility(
         self, multipliers: Multipliers, facility: str,
     ) -> float:
-        if facility == "Assembler":
-            return multipliers.assembler[self.assembler]
-        elif facility == "Smelting Facility":
-            return multipliers.smelting_facility[self.smelting_facility]
-        elif facility == "Chemical Facility":
-            return multipliers.chemical_facility[self.chemical_facility]
-        elif facility == "Research Facility":
+        if facility == ASSEMBLER:
+            return multipliers[ASSEMBLER, self.assembler]
+        elif facility == SMELTING_FACILITY:
+            return multipliers[SMELTING_FACILITY, self.smelting_facility]
+        elif facility == CHEMICAL_FACILITY:
+            return multipliers[CHEMICAL_FACILITY, self.chemical_facility]
+        elif facility == RESEARCH_FACILITY:
             return self.matrix_lab_height
-        elif facility == "Refining Facility":
+        elif facility == REFINING_FACILITY:
             return 1
         else:
             raise ValueError(f"Invalid facility: {facility}")
 
     def building_for_facility(self, facility: str) -> str:
-        if facility == "Assembler":
+        if facility == ASSEMBLER:
             return self.assembler
-        elif facility == "Smelting Facility":
+        elif facility == SMELTING_FACILITY:
             return self.smelting_facility
-        elif facility == "Chemical Facility":
+        elif facility == CHEMICAL_FACILITY:
             return self.chemical_facility
-        elif facility == "Research Facility":
+        elif facility == RESEARCH_FACILITY:
             return "Matrix Lab"
-        elif facility == "Refining Facility":
+        elif facility == REFINING_FACILITY:
             return "Oil Refinery"
         else:
             raise ValueError(f"Invalid facility: {facility}")
 
 
-@dataclass
+@dataclass(slots=True)
 class RequirementForMaterial:
     rate: float
     building: MaterialWithAmount
@@ -104,62 +137,120 @@ class RequirementForMaterial:
 Requirements = Mapping[str, RequirementForMaterial]
 
 
-def load_materials() -> List[str]:
-    with open(materials_path, "r") as file:
-        materials = yaml.load(file, Loader=yaml.FullLoader)
-    return materials
+@dataclass(slots=True)
+class RecipeMapEntry:
+    recipe: Recipe
+    output: MaterialWithAmount
+    # (input name, input amount per unit of output) for each recipe input
+    scaled_inputs: Tuple[Tuple[str, float], ...]
+    building_per_unit: float
 
 
-def load_recipes() -> List[Recipe]:
-    with open(recipes_path, "r") as file:
-        recipes = yaml.load(file, Loader=yaml.FullLoader)
+RecipeMap = Mapping[str, RecipeMapEntry]
 
-    for recipe in recipes:
-        recipe["input"] = [
-            MaterialWithAmount(**material) for material in recipe["input"]
-        ]
-        recipe["output"] = [
-            MaterialWithAmount(**material) for material in recipe["output"]
-        ]
+recipe_map_cache: Dict[int, Tuple[List[Recipe], RecipeMap]] = {}
 
-    recipes = [Recipe(**recipe) for recipe in recipes]
-    return recipes
 
+def load_cached(path: str) -> Any:
+    # The cache holds the plain YAML document rather than the dataclasses, so
+    # it does not depend on the name main.py was imported under.
+    cache_path = f"{path}.pkl"
+    stat = os.stat(path)
+    header = {
+        "path": path,
+        "mtime_ns": stat.st_mtime_ns,
+        "size": stat.st_size,
+        "version": cache_version,
+    }
 
-def load_facility_buildings() -> FacilityBuildings:
-    with open(facility_buildings_path, "r") as file:
-        facility_buildings = yaml.load(file, Loader=yaml.FullLoader)
+    try:
+        with open(cache_path, "rb") as file:
+            if pickle.load(file) == header:
+                return pickle.load(file)
+    except Exception:
+        # A missing, corrupt or incompatible cache is simply rebuilt below.
+        pass
+
+    with open(path, "rb") as file:
+        data = yaml.load(file.read(), Loader=CSafeLoader)
+    temporary_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        with open(temporary_path, "wb") as file:
+            pickle.dump(header, file, protocol=5)
+            pickle.dump(data, file, protocol=5)
+        os.replace(temporary_path, cache_path)
+    except (OSError, pickle.PicklingError):
+        # The cache is only an optimisation; leave no partial file behind.
+        try:
+            os.remove(temporary_path)
+        except OSError:
+            pass
+    return data
+
+
+def parse_recipes(data: Any) -> List[Recipe]:
+    # Disabled recipes are never used, so they are dropped here.
+    return [
+        Recipe(
+            input=tuple(
+                MaterialWithAmount(name=sys.intern(item["name"]), amount=item["amount"])
+                for item in recipe["input"]
+            ),
+            output=tuple(
+                MaterialWithAmount(name=sys.intern(item["name"]), amount=item["amount"])
+                for item in recipe["output"]
+            ),
+            made_in=sys.intern(recipe["made_in"]),
+            duration=recipe["duration"],
+            enabled=recipe["enabled"],
+        )
+        for recipe in data
+        if recipe["enabled"]
+    ]
+
+
+def parse_facility_buildings(data: Any) -> FacilityBuildings:
     return FacilityBuildings(
-        assembler=facility_buildings["Assembler"],
-        smelting_facility=facility_buildings["Smelting Facility"],
-        chemical_facility=facility_buildings["Chemical Facility"],
-        research_facility=facility_buildings["Research Facility"],
-        refining_facility=facility_buildings["Refining Facility"],
+        assembler=data[ASSEMBLER],
+        smelting_facility=data[SMELTING_FACILITY],
+        chemical_facility=data[CHEMICAL_FACILITY],
+        research_facility=data[RESEARCH_FACILITY],
+        refining_facility=data[REFINING_FACILITY],
     )
 
 
+def parse_multipliers(data: Any) -> Multipliers:
+    return {
+        (facility, sys.intern(building["name"])): building["value"]
+        for facility in (ASSEMBLER, SMELTING_FACILITY, CHEMICAL_FACILITY)
+        for building in data[facility]
+    }
+
+
+@lru_cache(maxsize=1)
+def load_materials() -> List[str]:
+    return load_cached(materials_path)
+
+
+@lru_cache(maxsize=1)
+def load_recipes() -> List[Recipe]:
+    return parse_recipes(load_cached(recipes_path))
+
+
+@lru_cache(maxsize=1)
+def load_facility_buildings() -> FacilityBuildings:
+    return parse_facility_buildings(load_cached(facility_buildings_path))
+
+
+@lru_cache(maxsize=1)
 def load_multipliers() -> Multipliers:
-    with open(multipliers_path, "r") as file:
-        multipliers = yaml.load(file, Loader=yaml.FullLoader)
-    return Multipliers(
-        assembler={
-            material["name"]: material["value"] for material in multipliers["Assembler"]
-        },
-        smelting_facility={
-            material["name"]: material["value"]
-            for material in multipliers["Smelting Facility"]
-        },
-        chemical_facility={
-            material["name"]: material["value"]
-            for material in multipliers["Chemical Facility"]
-        },
-    )
+    return parse_multipliers(load_cached(multipliers_path))
 
 
 def get_user_input(
     materials: List[str], facility_buildings: FacilityBuildings,
 ) -> UserInput:
-    material = input("Enter the material you want to produce: ")
+    material = sys.intern(input("Enter the material you want to produce: "))
     if material not in materials:
         raise ValueError(f"Invalid material: {material}")
 
@@ -169,17 +260,17 @@ def get_user_input(
         raise ValueError("Production rate must be positive")
 
     assembler = input("Enter the assembler (default - Assembling Machine Mk.1): ")
-    assembler = assembler if assembler else "Assembling Machine Mk.1"
+    assembler = sys.intern(assembler if assembler else "Assembling Machine Mk.1")
     if assembler not in facility_buildings.assembler:
         raise ValueError(f"Invalid assembler: {assembler}")
 
     smelter = input("Enter the smelting facility (default - Smelter): ")
-    smelter = smelter if smelter else "Smelter"
+    smelter = sys.intern(smelter if smelter else "Smelter")
     if smelter not in facility_buildings.smelting_facility:
         raise ValueError(f"Invalid smelting facility: {smelter}")
 
     chemical_plant = input("Enter the chemical facility (default - Chemical Plant): ")
-    chemical_plant = chemical_plant if chemical_plant else "Chemical Plant"
+    chemical_plant = sys.intern(chemical_plant if chemical_plant else "Chemical Plant")
     if chemical_plant not in facility_buildings.chemical_facility:
         raise ValueError(f"Invalid chemical facility: {chemical_plant}")
 
@@ -198,158 +289,479 @@ def get_user_input(
     )
 
 
-def build_recipe_map(recipes: List[Recipe]) -> Mapping[str, Recipe]:
-    return {
-        output.name: recipe
+def build_argument_parser(
+    materials: List[str],
+    facility_buildings: FacilityBuildings,
+    allow_serve: bool = False,
+) -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="Calculate the materials and buildings needed to produce "
+        "a material at a given rate."
+    )
+    target = parser
+    if allow_serve:
+        # With --serve the queries arrive on stdin, so it replaces --material.
+        target = parser.add_mutually_exclusive_group(required=True)
+        target.add_argument(
+            "--serve",
+            action="store_true",
+            help="answer one query per stdin line, written as these arguments",
+        )
+    target.add_argument(
+        "--material",
+        required=not allow_serve,
+        choices=materials,
+        metavar="MATERIAL",
+        help="material to produce",
+    )
+    parser.add_argument(
+        "--rate", type=float, default=1, help="production rate (default - 1)",
+    )
+    parser.add_argument(
+        "--assembler",
+        choices=facility_buildings.assembler,
+        default="Assembling Machine Mk.1",
+        help="assembler (default - Assembling Machine Mk.1)",
+    )
+    parser.add_argument(
+        "--smelter",
+        choices=facility_buildings.smelting_facility,
+        default="Smelter",
+        help="smelting facility (default - Smelter)",
+    )
+    parser.add_argument(
+        "--chemical-plant",
+        choices=facility_buildings.chemical_facility,
+        default="Chemical Plant",
+        help="chemical facility (default - Chemical Plant)",
+    )
+    parser.add_argument(
+        "--matrix-lab-height",
+        type=int,
+        default=3,
+        help="matrix lab height (default - 3)",
+    )
+    return parser
+
+
+def user_input_from_arguments(
+    parser: argparse.ArgumentParser, arguments: argparse.Namespace,
+) -> UserInput:
+    if arguments.rate <= 0:
+        parser.error("Production rate must be positive")
+    if arguments.matrix_lab_height <= 0:
+        parser.error("Matrix lab height must be positive")
+
+    return UserInput(
+        sys.intern(arguments.material),
+        arguments.rate,
+        sys.intern(arguments.assembler),
+        sys.intern(arguments.smelter),
+        sys.intern(arguments.chemical_plant),
+        arguments.matrix_lab_height,
+    )
+
+
+def parse_user_input(
+    materials: List[str],
+    facility_buildings: FacilityBuildings,
+    args: Optional[List[str]] = None,
+) -> UserInput:
+    if args is None:
+        args = sys.argv[1:]
+    # Without arguments, keep the original interactive prompts.
+    if not args:
+        return get_user_input(materials, facility_buildings)
+
+    parser = build_argument_parser(materials, facility_buildings)
+    return user_input_from_arguments(parser, parser.parse_args(args))
+
+
+def parse_command_line(
+    materials: List[str],
+    facility_buildings: FacilityBuildings,
+    args: Optional[List[str]] = None,
+) -> Optional[UserInput]:
+    # Like parse_user_input, but also accepts --serve, for which it returns None.
+    if args is None:
+        args = sys.argv[1:]
+    if not args:
+        return get_user_input(materials, facility_buildings)
+
+    parser = build_argument_parser(materials, facility_buildings, allow_serve=True)
+    arguments = parser.parse_args(args)
+    if arguments.serve:
+        # Every other option describes a single query, which --serve reads
+        # from stdin instead.
+        if len(args) > 1:
+            parser.error("argument --serve: not allowed with query options")
+        return None
+    return user_input_from_arguments(parser, arguments)
+
+
+def build_recipe_map(recipes: List[Recipe]) -> RecipeMap:
+    # The entry keeps the recipes list alive, so its id cannot be reused.
+    cached = recipe_map_cache.get(id(recipes))
+    if cached is not None:
+        return cached[1]
+
+    recipe_map = {
+        output.name: RecipeMapEntry(
+            recipe=recipe,
+            output=output,
+            scaled_inputs=tuple(
+                (input_material.name, input_material.amount / output.amount)
+                for input_material in recipe.input
+            ),
+            building_per_unit=recipe.duration / output.amount,
+        )
         for recipe in recipes
         for output in recipe.output
         if recipe.enabled
     }
-
-
-def merge_requirements(
-    requirements: List[Mapping[str, RequirementForMaterial]]
-) -> Mapping[str, RequirementForMaterial]:
-    merged_requirements: Mapping[str, RequirementForMaterial] = {}
-    for requirement in requirements:
-        for material, requirement_for_material in requirement.items():
-            if material in merged_requirements:
-                merged_requirements[material].rate += requirement_for_material.rate
-                merged_requirements[
-                    material
-                ].building.name = requirement_for_material.building.name
-                merged_requirements[
-                    material
-                ].building.amount += requirement_for_material.building.amount
-                merged_requirements[material].input = [
-                    merged_requirements[material].input[i]
-                    + requirement_for_material.input[i]
-                    for i in range(len(requirement_for_material.input))
-                ]
-            else:
-                merged_requirements[material] = requirement_for_material
-    return merged_requirements
+    recipe_map_cache.clear()
+    recipe_map_cache[id(recipes)] = (recipes, recipe_map)
+    return recipe_map
+
+
+@dataclass(slots=True)
+class RecipeGraph:
+    # Parallel lists over materials numbered 0..n-1. The inputs of
+    # material m live at input_offsets[m]:input_offsets[m + 1] of
+    # input_material/input_ratio; materials without a recipe have an empty
+    # range, no made_in and a building_per_unit of 0.
+    name_to_id: Mapping[str, int]
+    id_to_name: List[str]
+    made_in: List[str]
+    input_offsets: List[int]
+    input_material: List[int]
+    input_ratio: List[float]
+    building_per_unit: List[float]
+    multiplier: List[float]
+    # target id -> (order, rates, buildings) solved for a rate of 1
+    unit_solutions: Dict[
+        int, Tuple[List[int], List[float], List[float]]
+    ] = field(default_factory=dict)
+
+
+recipe_graph_cache: Dict[tuple, Tuple[RecipeMap, RecipeGraph]] = {}
+
+
+def build_recipe_graph(
+    recipe_map: RecipeMap, user_input: UserInput, multipliers: Multipliers,
+) -> RecipeGraph:
+    # The graph depends only on the speed multiplier of each facility, not on
+    # the target, so queries that only change the material or rate share it
+    # and its unit solutions. The key holds the multipliers the graph is built
+    # from, so it always describes the cached graph.
+    facility_multiplier = {
+        facility: user_input.multiplier_for_facility(multipliers, facility)
+        for facility in FACILITIES
+    }
+    key = (id(recipe_map), *facility_multiplier.values())
+    cached = recipe_graph_cache.get(key)
+    if cached is not None:
+        return cached[1]
+
+    name_to_id: Dict[str, int] = {}
+    for material, entry in recipe_map.items():
+        name_to_id.setdefault(material, len(name_to_id))
+        for input_name, _ in entry.scaled_inputs:
+            name_to_id.setdefault(input_name, len(name_to_id))
+    id_to_name = list(name_to_id)
+
+    made_in = [""] * len(id_to_name)
+    input_offsets = [0]
+    input_material: List[int] = []
+    input_ratio: List[float] = []
+    building_per_unit = [0.0] * len(id_to_name)
+    multiplier = [1.0] * len(id_to_name)
+    for material_id, material in enumerate(id_to_name):
+        entry = recipe_map.get(material)
+        if entry is not None:
+            made_in[material_id] = entry.recipe.made_in
+            building_per_unit[material_id] = entry.building_per_unit
+            try:
+                multiplier[material_id] = facility_multiplier[entry.recipe.made_in]
+            except KeyError:
+                raise ValueError(f"Invalid facility: {entry.recipe.made_in}") from None
+            for input_name, ratio in entry.scaled_inputs:
+                input_material.append(name_to_id[input_name])
+                input_ratio.append(ratio)
+        input_offsets.append(len(input_material))
+
+    recipe_graph = RecipeGraph(
+        name_to_id=name_to_id,
+        id_to_name=id_to_name,
+        made_in=made_in,
+        input_offsets=input_offsets,
+        input_material=input_material,
+        input_ratio=input_ratio,
+        building_per_unit=building_per_unit,
+        multiplier=multiplier,
+    )
+    recipe_graph_cache.clear()
+    recipe_graph_cache[key] = (recipe_map, recipe_graph)
+    return recipe_graph
+
+
+def solve_rates(
+    graph: RecipeGraph, target: int, target_rate: float,
+) -> Tuple[List[int], List[float], List[float]]:
+    input_offsets = graph.input_offsets
+    input_material = graph.input_material
+    input_ratio = graph.input_ratio
+    size = len(graph.id_to_name)
+
+    # Post-order DFS with an explicit stack: every material lands in order
+    # after all of its inputs. An edge back to a material still on the stack
+    # means the enabled recipes form a cycle, which has no finite solution.
+    order: List[int] = []
+    visited = [False] * size
+    on_stack = [False] * size
+    visited[target] = True
+    on_stack[target] = True
+    stack = [target]
+    stack_edge = [input_offsets[target]]
+    while stack:
+        material = stack[-1]
+        edge = stack_edge[-1]
+        if edge < input_offsets[material + 1]:
+            stack_edge[-1] = edge + 1
+            child = input_material[edge]
+            if on_stack[child]:
+                raise ValueError(f"Recipe cycle through {graph.id_to_name[child]}")
+            if not visited[child]:
+                visited[child] = True
+                if input_offsets[child] == input_offsets[child + 1]:
+                    # Raw materials have no inputs, so they are finished as
+                    # soon as they are reached and never need a stack frame.
+                    order.append(child)
+                else:
+                    on_stack[child] = True
+                    stack.append(child)
+                    stack_edge.append(input_offsets[child])
+        else:
+            order.append(material)
+            on_stack[material] = False
+            stack.pop()
+            stack_edge.pop()
+
+    # Walk consumers before their inputs so each material's total rate is
+    # known before it is pushed down to its own inputs.
+    building_per_unit = graph.building_per_unit
+    multiplier = graph.multiplier
+    rates = [0.0] * size
+    buildings = [0.0] * size
+    rates[target] = target_rate
+    for material in reversed(order):
+        rate = rates[material]
+        buildings[material] = rate * building_per_unit[material] / multiplier[material]
+        for edge in range(input_offsets[material], input_offsets[material + 1]):
+            rates[input_material[edge]] += rate * input_ratio[edge]
+    return order, rates, buildings
+
+
+def solve_unit(
+    graph: RecipeGraph, target: int
+) -> Tuple[List[int], List[float], List[float]]:
+    solution = graph.unit_solutions.get(target)
+    if solution is not None:
+        return solution
+
+    solution = solve_rates(graph, target, 1)
+    graph.unit_solutions[target] = solution
+    return solution
 
 
 def get_requirements(
     target_material: str,
     target_rate: float,
     user_input: UserInput,
-    recipe_map: Mapping[str, Recipe],
+    recipe_map: RecipeMap,
     multipliers: Multipliers,
 ) -> Requirements:
-    if target_material not in recipe_map:
-        return {
-            target_material: RequirementForMaterial(
-                target_rate, MaterialWithAmount(), input=[],
-            )
-        }
-
-    recipe = recipe_map[target_material]
-
-    def find_recipe_output_material() -> MaterialWithAmount:
-        for material in recipe.output:
-            if material.name == target_material:
-                return material
-        raise ValueError(f"Material not found in recipe output: {target_material}")
+    return get_combined_requirements(
+        {target_material: target_rate}, user_input, recipe_map, multipliers,
+    )
 
-    output_recipe_material = find_recipe_output_material()
 
-    requirements = [
-        get_requirements(
-            material.name,
-            target_rate / output_recipe_material.amount * material.amount,
+def get_combined_requirements(
+    targets: Mapping[str, float],
+    user_input: UserInput,
+    recipe_map: RecipeMap,
+    multipliers: Multipliers,
+) -> Requirements:
+    graph = build_recipe_graph(recipe_map, user_input, multipliers)
+
+    # Requirements are linear in the target rates, so the requirements for
+    # several targets are the rate-weighted sum of their unit solutions.
+    # Every target's order lists inputs first, and so does their union.
+    rates: Dict[int, float] = {}
+    buildings: Dict[int, float] = {}
+    unknown: Dict[str, float] = {}
+    for target_material, target_rate in targets.items():
+        if target_material not in graph.name_to_id:
+            unknown[target_material] = unknown.get(target_material, 0) + target_rate
+            continue
+        order, unit_rates, unit_buildings = solve_unit(
+            graph, graph.name_to_id[target_material]
+        )
+        for material_id in order:
+            rate = target_rate * unit_rates[material_id]
+            building = target_rate * unit_buildings[material_id]
+            rates[material_id] = rates.get(material_id, 0) + rate
+            buildings[material_id] = buildings.get(material_id, 0) + building
+
+    # Positional arguments keep the per-material constructor calls cheap.
+    id_to_name = graph.id_to_name
+    input_offsets = graph.input_offsets
+    input_material = graph.input_material
+    input_ratio = graph.input_ratio
+    requirements: Mapping[str, RequirementForMaterial] = {}
+    for material_id, rate in rates.items():
+        made_in = graph.made_in[material_id]
+        if not made_in:
+            building = MaterialWithAmount()
+        else:
+            building = MaterialWithAmount(
+                user_input.building_for_facility(made_in), buildings[material_id],
+            )
+        requirements[id_to_name[material_id]] = RequirementForMaterial(
+            rate,
+            building,
+            [
+                MaterialWithAmount(
+                    id_to_name[input_material[edge]], rate * input_ratio[edge],
+                )
+                for edge in range(
+                    input_offsets[material_id], input_offsets[material_id + 1],
+                )
+            ],
+        )
+    for material, rate in unknown.items():
+        requirements[material] = RequirementForMaterial(rate, MaterialWithAmount(), [])
+    return requirements
+
+
+@dataclass(slots=True)
+class Session:
+    materials: List[str]
+    facility_buildings: FacilityBuildings
+    recipe_map: RecipeMap
+    multipliers: Multipliers
+
+    def query(self, user_input: UserInput) -> Requirements:
+        return get_requirements(
+            user_input.material,
+            user_input.production_rate,
             user_input,
-            recipe_map,
-            multipliers,
+            self.recipe_map,
+            self.multipliers,
         )
-        for material in recipe.input
-    ]
 
-    requirements.append(
-        {
-            target_material: RequirementForMaterial(
-                rate=target_rate,
-                building=MaterialWithAmount(
-                    name=user_input.building_for_facility(recipe.made_in),
-                    amount=target_rate,
-                )
-                * recipe.duration
-                / output_recipe_material.amount
-                / user_input.multiplier_for_facility(multipliers, recipe.made_in),
-                input=[
-                    material * target_rate / output_recipe_material.amount
-                    for material in recipe.input
-                ],
-            )
-        }
+
+def load_session() -> Session:
+    return Session(
+        load_materials(),
+        load_facility_buildings(),
+        build_recipe_map(load_recipes()),
+        load_multipliers(),
     )
 
-    return merge_requirements(requirements)
 
+def format_float(value: float) -> str:
+    return f"{value:.2f}" if value != 0 else ""
 
-if __name__ == "__main__":
-    materials = load_materials()
-    recipes = load_recipes()
-    facility_buildings = load_facility_buildings()
-    multipliers = load_multipliers()
 
-    user_input = get_user_input(materials, facility_buildings)
+def print_material_table(requirements: Requirements):
+    format_value = format_float
+    table = [
+        [
+            material,
+            format_value(requirement.rate),
+            requirement.building.name,
+            format_value(requirement.building.amount),
+            *chain.from_iterable(
+                (input_material.name, format_value(input_material.amount))
+                for input_material in requirement.input
+            ),
+        ]
+        for material, requirement in requirements.items()
+    ]
+    max_input = max(
+        (len(requirement.input) for requirement in requirements.values()), default=0,
+    )
 
-    recipe_map = build_recipe_map(recipes)
+    headers = ["Material", "Rate", "Building", "Amount"]
+    for i in range(max_input):
+        headers.extend([f"Input {i + 1}", "Rate"])
+    print(tabulate(table, headers=headers, numalign="left"))
 
-    requirements = get_requirements(
-        user_input.material,
-        user_input.production_rate,
-        user_input,
-        recipe_map,
-        multipliers,
-    )
 
-    def format_float(value: float) -> str:
-        return f"{value:.2f}" if value != 0 else ""
-
-    def print_material_table():
-        table = []
-        max_input = 0
-        for material, requirement in requirements.items():
-            table.append(
-                [
-                    material,
-                    format_float(requirement.rate),
-                    requirement.building.name,
-                    format_float(requirement.building.amount),
-                ]
-            )
-            max_input = max(max_input, len(requirement.input))
-            for input_material in requirement.input:
-                table[-1].extend(
-                    [input_material.name, format_float(input_material.amount)]
-                )
+def print_building_table(requirements: Requirements):
+    buildings: Mapping[str, float] = {}
+    for requirement in requirements.values():
+        building = requirement.building
+        if building.name == "":
+            continue
+        buildings[building.name] = buildings.get(building.name, 0) + building.amount
 
-        headers = ["Material", "Rate", "Building", "Amount"]
-        for i in range(max_input):
-            headers.extend([f"Input {i + 1}", "Rate"])
-        print(tabulate(table, headers=headers, numalign="left"))
-
-    def print_building_table():
-        buildings: Mapping[str, MaterialWithAmount] = {}
-        for _, requirement in requirements.items():
-            if requirement.building.name == "":
-                continue
-            if requirement.building.name in buildings:
-                buildings[requirement.building.name] += requirement.building
-            else:
-                buildings[requirement.building.name] = requirement.building
-
-        table = [
-            [building, format_float(material.amount)]
-            for building, material in buildings.items()
-        ]
+    table = [
+        [building, format_float(amount)] for building, amount in buildings.items()
+    ]
 
-        print(tabulate(table, headers=["Building", "Amount"], numalign="left",))
+    print(tabulate(table, headers=["Building", "Amount"], numalign="left",))
 
+
+def print_requirements(requirements: Requirements):
     print()
-    print_material_table()
+    print_material_table(requirements)
     print()
-    print_building_table()
+    print_building_table(requirements)
+
+
+def serve(session: Session):
+    # Answers one query per stdin line, written as the usual command-line
+    # arguments, while the loaded data and solved graphs stay in memory.
+    for line in sys.stdin:
+        try:
+            args = shlex.split(line)
+        except ValueError as error:
+            print(f"error: {error}", file=sys.stderr)
+            continue
+        if not args:
+            continue
+        try:
+            user_input = parse_user_input(
+                session.materials, session.facility_buildings, args
+            )
+        except SystemExit:
+            # argparse has already reported the problem on stderr.
+            continue
+        print_requirements(session.query(user_input))
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    # Recipes and multipliers are only needed once the input has been read,
+    # so load them in the background while arguments or prompts are handled.
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        recipe_map_future = executor.submit(lambda: build_recipe_map(load_recipes()))
+        multipliers_future = executor.submit(load_multipliers)
+
+        materials = load_materials()
+        facility_buildings = load_facility_buildings()
+        user_input = parse_command_line(materials, facility_buildings)
+
+        session = Session(
+            materials,
+            facility_buildings,
+            recipe_map_future.result(),
+            multipliers_future.result(),
+        )
+
+    if user_input is None:
+        serve(session)
+    else:
+        print_requirements(session.query(user_input))